@@ -1,20 +1,30 @@
 # app.py
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import joblib, os, pandas as pd
+from fastapi import FastAPI, HTTPException, Response
+from pydantic import BaseModel, Field
+from typing import Annotated
+import joblib, os
+import numpy as np
+from sklearn.preprocessing import StandardScaler
 import time
 import logging
 import math
-import html as _html
+import re
+import html
+import functools
+import copy
+import asyncio
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Helpers para cargar modelo
-def wait_for_model(model_path: str, timeout: int = 60) -> bool:
+def _poll_for_model(model_path: str, timeout: int) -> bool:
     start_time = time.time()
-    logger.info(f"Waiting for model at {model_path} (timeout: {timeout}s)")
     while time.time() - start_time < timeout:
         if os.path.exists(model_path):
             logger.info(f"Model found at {model_path}")
@@ -25,11 +35,81 @@ def wait_for_model(model_path: str, timeout: int = 60) -> bool:
     logger.error(f"Model not found after {timeout}s timeout")
     return False
 
+def wait_for_model(model_path: str, timeout: int = 60) -> bool:
+    logger.info(f"Waiting for model at {model_path} (timeout: {timeout}s)")
+    if os.path.exists(model_path):
+        logger.info(f"Model found at {model_path}")
+        return True
+
+    # Eventos del sistema de ficheros: volvemos en cuanto el modelo está completo,
+    # sin sondear
+    model_dir = os.path.dirname(os.path.abspath(model_path))
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        return _poll_for_model(model_path, timeout)
+    # solo inotify emite "closed" (IN_CLOSE_WRITE); con otros observers
+    # seguimos sondeando
+    if not os.path.isdir(model_dir) or "inotify" not in Observer.__module__:
+        return _poll_for_model(model_path, timeout)
+
+    found = threading.Event()
+    target = os.path.abspath(model_path)
+
+    class _ModelHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            # "created"/"modified" llegan con el primer write del trainer: el
+            # fichero aún está a medias.
+            # Solo vale el cierre tras escribir o un rename atómico sobre el modelo.
+            if event.event_type == "closed":
+                path = event.src_path
+            elif event.event_type == "moved":
+                path = event.dest_path
+            else:
+                return
+            if os.path.abspath(path) == target:
+                found.set()
+
+    observer = Observer()
+    observer.schedule(_ModelHandler(), model_dir, recursive=False)
+    observer.start()
+    try:
+        deadline = time.monotonic() + timeout
+        last_size = -1
+        while (remaining := deadline - time.monotonic()) > 0:
+            if found.wait(min(remaining, 1.0)):
+                logger.info(f"Model found at {model_path}")
+                return True
+            # pudo escribirse y cerrarse antes de arrancar el observer: si existe
+            # y no ha crecido en el último segundo, está completo
+            size = os.path.getsize(model_path) if os.path.exists(model_path) else -1
+            if size > 0 and size == last_size:
+                logger.info(f"Model found at {model_path}")
+                return True
+            last_size = size
+    finally:
+        observer.stop()
+        observer.join()
+    logger.error(f"Model not found after {timeout}s timeout")
+    return False
+
+# Última comprobación antes de cargar: el fichero sigue ahí y no está vacío
+def model_file_ready(model_path: str) -> bool:
+    try:
+        return os.path.getsize(model_path) > 0
+    except OSError:
+        return False
+
 def load_model_safely(model_path: str, timeout: int = 60):
     if not wait_for_model(model_path, timeout):
         raise RuntimeError(f"Model not found after {timeout}s. Run training first.")
+    if not model_file_ready(model_path):
+        raise RuntimeError(f"Model file at {model_path} is missing or empty.")
     try:
-        model = joblib.load(model_path)
+        # mmap_mode='r': los arrays del modelo se mapean de disco y los workers
+        # de uvicorn comparten las mismas páginas en vez de copiarlas cada uno
+        model = joblib.load(model_path, mmap_mode="r")
         logger.info("Model loaded successfully")
         return model
     except Exception as e:
@@ -44,9 +124,277 @@ MODEL_WAIT_TIMEOUT = int(os.getenv("MODEL_WAIT_TIMEOUT", "60"))
 PRICE_MULTIPLIER = float(os.getenv("PRICE_MULTIPLIER", "100000.0"))
 EUR_TO_USD = float(os.getenv("EUR_TO_USD", "1.10"))
 TARGET_TRANSFORM = os.getenv("TARGET_TRANSFORM", "none").lower()  # none | log | log1p
+# sklearn | treelite | onnx | trees
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "sklearn").lower()
+MODEL_DIR = os.path.dirname(MODEL_PATH)
+COMPILED_MODEL_PATH = os.getenv(
+    "COMPILED_MODEL_PATH", os.path.join(MODEL_DIR, "predictor.so")
+)
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", os.path.join(MODEL_DIR, "model.onnx"))
+TREES_PATH = os.getenv("TREES_PATH", os.path.join(MODEL_DIR, "trees.npz"))
+# 0 desactiva la caché
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+# Micro-batching: peticiones concurrentes se agrupan en un único model.predict
+PREDICT_MAX_BATCH = int(os.getenv("PREDICT_MAX_BATCH", "64"))
+PREDICT_MAX_WAIT_MS = float(os.getenv("PREDICT_MAX_WAIT_MS", "5"))
+# Filas máximas por petición a /predict-batch (más -> 422)
+PREDICT_BATCH_LIMIT = int(os.getenv("PREDICT_BATCH_LIMIT", "1000"))
+
+# Orden de features con el que se entrena el modelo (scripts/train.py)
+FEATURES = (
+    "MedInc", "HouseAge", "AveRooms", "AveBedrms",
+    "Population", "AveOccup", "Latitude", "Longitude",
+)
+N_FEATURES = len(FEATURES)
+
+# Pasos ajustados sobre un DataFrame (modelos antiguos) guardan feature_names_in_ y
+# sklearn avisa en cada predict con arrays posicionales. Se comprueba una vez que el
+# orden es FEATURES y se usa una copia superficial sin los nombres; el modelo cargado
+# no se modifica.
+def positional_step(step):
+    names = getattr(step, "feature_names_in_", None)
+    if names is None:
+        return step
+    if tuple(names) != FEATURES:
+        raise RuntimeError(
+            f"Model was fitted with features {list(names)}, expected {list(FEATURES)}"
+        )
+    step = copy.copy(step)
+    step.feature_names_in_ = None
+    return step
+
+# Parámetros del StandardScaler del pipeline para aplicarlo a mano:
+# (x - mean) * inv_scale
+def scaler_params(pipeline):
+    scaler = getattr(pipeline, "named_steps", {}).get("scaler")
+    if scaler is None:
+        return None, None
+    # el scaler recibe la entrada posicional: mismo chequeo de orden de features
+    scaler = positional_step(scaler)
+    n = scaler.n_features_in_
+    # mean_ existe aunque with_mean=False (lo calcula para el std): solo se resta
+    # si with_mean
+    mean = scaler.mean_ if scaler.with_mean and scaler.mean_ is not None else None
+    if mean is None:
+        mean = np.zeros(n)
+    inv_scale = np.ones(n) if scaler.scale_ is None else 1.0 / scaler.scale_
+    return mean.astype(np.float64), inv_scale.astype(np.float64)
+
+# sklearn.tree (RandomForest, GradientBoosting) recorre los árboles en float32 y
+# HistGradientBoosting en float64: construir el lote ya en ese dtype evita una copia
+# en predict
+def estimator_input_dtype(estimator):
+    if hasattr(estimator, "tree_") or hasattr(estimator, "estimators_"):
+        return np.float32
+    return np.float64
+
+# dtype del lote que construye el MicroBatcher para el backend sklearn: si hay
+# transforms la entrada va en float64 (como en Pipeline.predict) y solo su salida
+# se baja al dtype del estimador
+def sklearn_input_dtype(pipeline):
+    steps = getattr(pipeline, "steps", None) or [(None, pipeline)]
+    if len(steps) > 1:
+        return np.float64
+    return estimator_input_dtype(steps[-1][1])
+
+def build_sklearn_predictor(pipeline):
+    """
+    Llama a los pasos del pipeline directamente, sin el dispatch de Pipeline.predict.
+    Un único StandardScaler previo se fusiona en una sola operación vectorizada,
+    evitando la validación/copia de StandardScaler.transform.
+    """
+    steps = getattr(pipeline, "steps", None)
+    if not steps:
+        return positional_step(pipeline).predict
+    transforms, estimator = steps[:-1], steps[-1][1]
+    if not transforms:
+        return positional_step(estimator).predict
+    if len(transforms) != 1 or not isinstance(transforms[0][1], StandardScaler):
+        # otros pipelines: encadenamos transform -> predict a mano, sin Pipeline.predict
+        transformers = [t for _, t in transforms if t not in (None, "passthrough")]
+        # solo el primer paso recibe la entrada posicional de la petición
+        if transformers:
+            transformers[0] = positional_step(transformers[0])
+        else:
+            estimator = positional_step(estimator)
+
+        def predict_steps(X):
+            for t in transformers:
+                X = t.transform(X)
+            return estimator.predict(X)
+
+        return predict_steps
+    # el scaler recibe la entrada posicional: se valida su orden de features
+    scaler = positional_step(transforms[0][1])
+    # con set_output(transform="pandas") el estimador también se ajustó con nombres
+    estimator = positional_step(estimator)
+    n = scaler.n_features_in_
+    # mismas operaciones que StandardScaler.transform, en float64: (x - mean) / scale
+    mean = scaler.mean_ if scaler.with_mean else None
+    scale = scaler.scale_ if scaler.with_std else None
+    mean = np.zeros(n) if mean is None else mean
+    scale = np.ones(n) if scale is None else scale
+    mean, scale = mean.astype(np.float64), scale.astype(np.float64)
+    dtype = estimator_input_dtype(estimator)
+    # buffers por hilo de PREDICT_MAX_BATCH filas: escalado en float64 y, si el
+    # estimador trabaja en float32, solo el resultado escalado se baja a float32
+    # (como hace sklearn)
+    tls = threading.local()
+
+    def predict(X):
+        rows = X.shape[0]
+        if rows > PREDICT_MAX_BATCH:
+            # lotes grandes (/predict-batch): arrays temporales, los buffers
+            # cacheados no crecen
+            Xs = np.empty(X.shape, dtype=np.float64)
+            out = Xs if dtype == np.float64 else np.empty(X.shape, dtype=dtype)
+        else:
+            bufs = getattr(tls, "bufs", None)
+            if bufs is None:
+                buf64 = np.empty((PREDICT_MAX_BATCH, n), dtype=np.float64)
+                out = buf64
+                if dtype != np.float64:
+                    out = np.empty((PREDICT_MAX_BATCH, n), dtype=dtype)
+                bufs = tls.bufs = (buf64, out)
+            Xs, out = bufs[0][:rows], bufs[1][:rows]
+        np.subtract(X, mean, out=Xs)
+        np.divide(Xs, scale, out=Xs)
+        if out is not Xs:
+            out[:] = Xs
+        return estimator.predict(out)
+
+    return predict
+
+def load_treelite_predictor(path: str, pipeline):
+    """Predictor nativo compilado con Treelite/TL2cgen por scripts/train.py."""
+    try:
+        import tl2cgen
+    except ImportError as e:
+        raise RuntimeError(
+            "MODEL_BACKEND=treelite requires the 'tl2cgen' package"
+        ) from e
+    if not os.path.exists(path):
+        raise RuntimeError(
+            f"Compiled model not found at {path}. "
+            "Run training with treelite installed."
+        )
+    predictor = tl2cgen.Predictor(path)
+    logger.info(f"Compiled model loaded from {path}")
+    mean, inv_scale = scaler_params(pipeline)
+
+    def predict(X):
+        if mean is not None:
+            X = (X - mean) * inv_scale
+        return predictor.predict(tl2cgen.DMatrix(X, dtype="float64")).reshape(-1)
+
+    return predict
+
+def load_onnx_predictor(path: str):
+    """Pipeline completo exportado a ONNX por scripts/train.py, con onnxruntime."""
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise RuntimeError(
+            "MODEL_BACKEND=onnx requires the 'onnxruntime' package"
+        ) from e
+    if not os.path.exists(path):
+        raise RuntimeError(
+            f"ONNX model not found at {path}. Run training with skl2onnx installed."
+        )
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = 1
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess = ort.InferenceSession(
+        path, sess_options=opts, providers=["CPUExecutionProvider"]
+    )
+    input_name = sess.get_inputs()[0].name
+    logger.info(f"ONNX model loaded from {path}")
+
+    def predict(X):
+        return sess.run(None, {input_name: X.astype(np.float32)})[0].reshape(-1)
+
+    return predict
+
+class TreeEnsemble:
+    """
+    Ensemble de árboles a partir de los arrays planos que exporta scripts/train.py
+    (trees.npz): se carga sin unpickle y predice recorriendo todos los árboles
+    y todas las filas a la vez, un nivel de profundidad por iteración.
+    """
+
+    def __init__(self, arrays):
+        self.children_left = arrays["children_left"]
+        self.children_right = arrays["children_right"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.value = arrays["value"]
+        self.missing_go_to_left = arrays["missing_go_to_left"]
+        self.scale = float(arrays["scale"])
+        self.bias = float(arrays["bias"])
+        self.mean = arrays.get("mean")
+        self.inv_scale = arrays.get("inv_scale")
+        self._trees = np.arange(self.children_left.shape[0])[:, None]
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as f:
+            return cls({k: f[k] for k in f.files})
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if self.mean is not None:
+            X = (X - self.mean) * self.inv_scale
+        trees, rows = self._trees, np.arange(X.shape[0])[None, :]
+        node = np.zeros((trees.shape[0], X.shape[0]), dtype=np.intp)
+        while True:
+            left = self.children_left[trees, node]
+            active = left >= 0
+            if not active.any():
+                break
+            xv = X[rows, self.feature[trees, node]]
+            go_left = np.where(
+                np.isnan(xv),
+                self.missing_go_to_left[trees, node],
+                xv <= self.threshold[trees, node],
+            )
+            right = self.children_right[trees, node]
+            node = np.where(active, np.where(go_left, left, right), node)
+        return self.value[trees, node].sum(axis=0) * self.scale + self.bias
+
+def load_tree_ensemble(path: str, timeout: int = 60) -> TreeEnsemble:
+    if not wait_for_model(path, timeout):
+        raise RuntimeError(
+            f"Tree arrays not found after {timeout}s. Run training first."
+        )
+    try:
+        ensemble = TreeEnsemble.load(path)
+        logger.info(f"Tree arrays loaded from {path}")
+        return ensemble
+    except Exception as e:
+        logger.error(f"Failed to load tree arrays: {e}")
+        raise RuntimeError(f"Failed to load tree arrays: {e}")
 
 # Load model
-model = load_model_safely(MODEL_PATH, MODEL_WAIT_TIMEOUT)
+if MODEL_BACKEND == "trees":
+    # sin joblib: el ensemble se reconstruye solo a partir de los arrays
+    LOADED_MODEL_PATH = TREES_PATH
+    model = load_tree_ensemble(LOADED_MODEL_PATH, MODEL_WAIT_TIMEOUT)
+else:
+    LOADED_MODEL_PATH = MODEL_PATH
+    model = load_model_safely(LOADED_MODEL_PATH, MODEL_WAIT_TIMEOUT)
+
+if MODEL_BACKEND == "trees":
+    _backend_predict = model.predict
+    INPUT_DTYPE = np.float64
+elif MODEL_BACKEND == "treelite":
+    _backend_predict = load_treelite_predictor(COMPILED_MODEL_PATH, model)
+    INPUT_DTYPE = np.float64
+elif MODEL_BACKEND == "onnx":
+    _backend_predict = load_onnx_predictor(ONNX_MODEL_PATH)
+    INPUT_DTYPE = np.float32
+else:
+    _backend_predict = build_sklearn_predictor(model)
+    INPUT_DTYPE = sklearn_input_dtype(model)
 
 app = FastAPI(title="Housing Price Predictor API", version="1.0.0")
 
@@ -74,21 +422,266 @@ class PredictResponse(BaseModel):
 class PredictStringInput(BaseModel):
     input: str
 
-# Formateadores:
+class RootResponse(BaseModel):
+    msg: str
+    model_loaded: bool
+
+class HealthResponse(BaseModel):
+    status: str
+    model_loaded: bool
+    model_path: str
+
+class CacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+# Predicción cruda del modelo para un lote (n, 8)
+def predict_batch(X: np.ndarray) -> np.ndarray:
+    return _backend_predict(X)
+
+class MicroBatcher:
+    """
+    Agrupa las filas que llegan dentro de una ventana de max_wait_ms (hasta
+    max_batch) y las resuelve con una sola llamada a predict_fn.
+    Un hilo propio recoge los lotes (no depende de ningún event loop) y, si se
+    le pasa un executor, el predict de cada lote corre allí mientras se forma el
+    siguiente.
+    """
+
+    def __init__(
+        self,
+        predict_fn,
+        max_batch: int,
+        max_wait_ms: float,
+        dtype=np.float64,
+        executor=None,
+    ):
+        self._predict_fn = predict_fn
+        self._dtype = dtype
+        self._executor = executor
+        self._max_batch = max(1, max_batch)
+        self._max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._tls = threading.local()
+
+    def submit(self, feats: tuple) -> Future:
+        if self._worker is None:
+            self._start()
+        fut = Future()
+        self._queue.put((feats, fut))
+        return fut
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="predict-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self) -> list:
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(items) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    items.append(self._queue.get(timeout=remaining))
+                else:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if self._executor is None:
+                self._resolve(items)
+                continue
+            try:
+                self._executor.submit(self._resolve, items)
+            except RuntimeError:
+                # executor cerrado (apagado del proceso): resolvemos aquí mismo
+                self._resolve(items)
+
+    def _resolve(self, items: list):
+        # nada de lo que pase aquí puede dejar un Future sin resolver: el handler
+        # lo espera
+        try:
+            self._resolve_batch(items)
+        except Exception as e:
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+
+    def _predict_rows(self, X: np.ndarray) -> np.ndarray:
+        preds = self._predict_fn(X)
+        if len(preds) != len(X):
+            raise RuntimeError(
+                f"Model returned {len(preds)} predictions for {len(X)} rows"
+            )
+        return preds
+
+    def _resolve_batch(self, items: list):
+        # cada hilo reutiliza su buffer (max_batch, n_features) en vez de crear un
+        # array por lote
+        buf = getattr(self._tls, "buf", None)
+        if buf is None:
+            shape = (self._max_batch, len(items[0][0]))
+            buf = self._tls.buf = np.empty(shape, dtype=self._dtype)
+        X = buf[:len(items)]
+        X[:] = [feats for feats, _ in items]
+        try:
+            preds = self._predict_rows(X)
+        except Exception:
+            # si el lote falla, resolvemos fila a fila para que solo falle la culpable
+            for i, (_, fut) in enumerate(items):
+                try:
+                    fut.set_result(float(self._predict_rows(X[i:i + 1])[0]))
+                except Exception as e:
+                    fut.set_exception(e)
+            return
+        for (_, fut), p in zip(items, preds):
+            fut.set_result(float(p))
+
+class PredictionCache:
+    """LRU acotada con get/put explícitos, para rellenarla desde handlers async."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(0, maxsize)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "maxsize": self.maxsize,
+                "currsize": len(self._data),
+            }
+
+# Solo el predict (código C, suelta el GIL) corre en hilos; parseo y formateo se
+# quedan en el event loop
+_PREDICT_POOL = ThreadPoolExecutor(
+    max_workers=os.cpu_count(), thread_name_prefix="predict"
+)
+batcher = MicroBatcher(
+    predict_batch,
+    PREDICT_MAX_BATCH,
+    PREDICT_MAX_WAIT_MS,
+    dtype=INPUT_DTYPE,
+    executor=_PREDICT_POOL,
+)
+
+# Caché LRU: entradas repetidas (reintentos, polling de n8n) no recorren el modelo
+# otra vez
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE)
+
+async def predict_raw(feats: tuple) -> float:
+    """Predicción cruda para una fila (tupla de 8 floats en orden FEATURES)."""
+    # NaN/Inf no se cachean: NaN != NaN nunca daría hit y solo ocuparía sitio
+    if not all(map(math.isfinite, feats)):
+        return await asyncio.wrap_future(batcher.submit(feats))
+    raw = prediction_cache.get(feats)
+    if raw is None:
+        raw = await asyncio.wrap_future(batcher.submit(feats))
+        prediction_cache.put(feats, raw)
+    return raw
+
+# Lectura directa de atributos en orden FEATURES: sin .dict() ni DataFrame intermedios
+def request_features(req: PredictRequest) -> tuple:
+    return (
+        req.MedInc, req.HouseAge, req.AveRooms, req.AveBedrms,
+        req.Population, req.AveOccup, req.Latitude, req.Longitude,
+    )
+
+def parse_csv_input(s: str) -> np.ndarray:
+    """Parsea '1,2,...,8' (o con ';') directamente a un ndarray de 8 floats."""
+    # campos vacíos (',,' o separador final) se ignoran, como siempre ha hecho la API
+    parts = [p.strip() for p in s.strip().replace(";", ",").split(",")]
+    parts = [p for p in parts if p != ""]
+    if len(parts) != N_FEATURES:
+        raise ValueError(
+            f"Input must contain exactly {N_FEATURES} numerical values "
+            f"(got {len(parts)})"
+        )
+    try:
+        return np.asarray(parts, dtype=np.float64)
+    except ValueError:
+        raise ValueError(
+            "Input must contain only numerical values separated by commas"
+        ) from None
+
+# Formateadores (memoizados: el mismo importe redondeado se repite a menudo):
+@functools.lru_cache(maxsize=8192)
 def format_usd_en(v: float) -> str:
     """Formato americano: 1,234,567.89"""
     return f"{v:,.2f}"
 
+# Tabla para intercambiar ',' <-> '.' en una sola pasada
+_EU_SEPARATORS = str.maketrans(",.", ".,")
+
+@functools.lru_cache(maxsize=8192)
 def format_eur_eu(v: float) -> str:
     """
     Formato europeo común: 1.234.567,89
     Implementación sin dependencias de locale.
     """
-    # Usamos primero la representación con coma como separador de miles y punto decimal
-    s = f"{v:,.2f}"            # '1,234,567.89'
-    # intercambiamos comas/puntos -> '1.234.567,89'
-    s = s.replace(",", "X").replace(".", ",").replace("X", ".")
-    return s
+    # '1,234,567.89' -> '1.234.567,89' (un solo translate en vez de tres replace)
+    return f"{v:,.2f}".translate(_EU_SEPARATORS)
+
+# Los importes formateados (finitos) solo contienen dígitos, separadores, espacio,
+# signo y la divisa, así que no necesitan html.escape. Cualquier texto de usuario
+# que se añada sí debe escaparse.
+_SAFE_FMT = re.compile(r"[0-9 .,A-Z-]+")
+
+# Mensajes text/HTML para un par de importes ya formateados (plantilla pura, memoizada)
+@functools.lru_cache(maxsize=8192)
+def _build_messages(eur_fmt: str, usd_fmt: str) -> tuple:
+    # comprobación explícita (no assert, que desaparece con python -O): lo que no
+    # encaje con el formato esperado se escapa antes de ir al HTML
+    if _SAFE_FMT.fullmatch(eur_fmt) and _SAFE_FMT.fullmatch(usd_fmt):
+        eur_html, usd_html = eur_fmt, usd_fmt
+    else:
+        eur_html, usd_html = html.escape(eur_fmt), html.escape(usd_fmt)
+    # plain text
+    message_text = (
+        f"Estimated price: {eur_fmt} / {usd_fmt}\n\n"
+        "Details:\n- Status: success\n"
+    )
+    # HTML for Telegram (parse_mode=HTML)
+    message_html = (
+        f"🏠 <b>Estimated price</b>\n{eur_html} / {usd_html}\n\n"
+        "🔎 <b>Details</b>:\n• Status: success"
+    )
+    return message_text, message_html
 
 # convertir la salida cruda del modelo a valor en EUR reales (según TARGET_TRANSFORM)
 def inverse_transform(raw_pred: float) -> float:
@@ -101,107 +694,79 @@ def inverse_transform(raw_pred: float) -> float:
         val = rp * PRICE_MULTIPLIER
     return float(val)
 
-@app.get("/")
+# Todas las rutas declaran response_model: FastAPI serializa con Pydantic directamente
+# a bytes JSON (pydantic-core), sin pasar por jsonable_encoder + json.dumps
+@app.get("/", response_model=RootResponse)
 def root():
     return {"msg": "Housing Price Predictor API", "model_loaded": model is not None}
 
-@app.get("/health")
+@app.get("/health", response_model=HealthResponse)
 def health_check():
-    return {"status": "healthy", "model_loaded": model is not None, "model_path": MODEL_PATH}
+    # artefacto cargado realmente: trees.npz con MODEL_BACKEND=trees
+    return {
+        "status": "healthy",
+        "model_loaded": model is not None,
+        "model_path": LOADED_MODEL_PATH,
+    }
 
-@app.post("/predict", response_model=PredictResponse)
-def predict(req: PredictRequest):
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
-    try:
-        df = pd.DataFrame([req.dict()])
-        raw_pred = model.predict(df)[0]
+@app.get("/cache-stats", response_model=CacheStatsResponse)
+def cache_stats():
+    return prediction_cache.cache_info()
 
-        pred_eur_value = inverse_transform(raw_pred)
-        pred_usd_value = pred_eur_value * EUR_TO_USD
+# Cuerpo JSON de PredictResponse para una predicción cruda, serializado directamente
+def prediction_body(raw_pred: float) -> str:
+    pred_eur_value = inverse_transform(raw_pred)
+    pred_usd_value = pred_eur_value * EUR_TO_USD
+    # inf/nan no son un precio: error claro en vez de formatear "inf EUR"
+    if not (math.isfinite(pred_eur_value) and math.isfinite(pred_usd_value)):
+        raise RuntimeError(f"Model returned a non-finite prediction ({raw_pred})")
 
-        # redondeamos a 2 decimales para presentacion y formatamos apropiadamente
-        pred_eur_rounded = round(float(pred_eur_value), 2)
-        pred_usd_rounded = round(float(pred_usd_value), 2)
+    # redondeamos a 2 decimales para presentacion y formatamos apropiadamente
+    pred_eur_rounded = round(float(pred_eur_value), 2)
+    pred_usd_rounded = round(float(pred_usd_value), 2)
 
-        eur_fmt = format_eur_eu(pred_eur_rounded) + " EUR"
-        usd_fmt = format_usd_en(pred_usd_rounded) + " USD"
+    eur_fmt = format_eur_eu(pred_eur_rounded) + " EUR"
+    usd_fmt = format_usd_en(pred_usd_rounded) + " USD"
 
-        # plain text
-        message_text = (
-            f"Estimated price: {eur_fmt} / {usd_fmt}\n\n"
-            f"Details:\n"
-            f"- Status: success\n"
-        )
+    message_text, message_html = _build_messages(eur_fmt, usd_fmt)
 
-        # HTML for Telegram (parse_mode=HTML) — escapamos valores por seguridad aunque sean números
-        message_html = (
-            f"🏠 <b>Estimated price</b>\n"
-            f"{_html.escape(eur_fmt)} / {_html.escape(usd_fmt)}\n\n"
-            f"🔎 <b>Details</b>:\n"
-            f"• Status: {_html.escape('success')}"
-        )
+    return PredictResponse.model_construct(
+        prediction=pred_eur_rounded,
+        prediction_eur=pred_eur_rounded,
+        prediction_usd=pred_usd_rounded,
+        prediction_eur_formatted=eur_fmt,
+        prediction_usd_formatted=usd_fmt,
+        status="success",
+        message_text=message_text,
+        message_html=message_html
+    ).model_dump_json()
 
-        return PredictResponse(
-            prediction=pred_eur_rounded,
-            prediction_eur=pred_eur_rounded,
-            prediction_usd=pred_usd_rounded,
-            prediction_eur_formatted=eur_fmt,
-            prediction_usd_formatted=usd_fmt,
-            status="success",
-            message_text=message_text,
-            message_html=message_html
-        )
+# Respuesta de predicción ya serializada: PredictResponse se mantiene como
+# response_model para el esquema OpenAPI, pero al devolver un Response FastAPI no
+# vuelve a validarla
+def prediction_response(raw_pred: float) -> Response:
+    return Response(content=prediction_body(raw_pred), media_type="application/json")
+
+@app.post("/predict", response_model=PredictResponse)
+async def predict(req: PredictRequest):
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    try:
+        raw_pred = await predict_raw(request_features(req))
+        return prediction_response(raw_pred)
     except Exception as e:
         logger.error(f"Prediction error: {e}")
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 @app.post("/predict-from-string", response_model=PredictResponse)
-def predict_from_string(data: PredictStringInput):
+async def predict_from_string(data: PredictStringInput):
     if model is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     try:
-        s = data.input.strip().replace(";", ",")
-        parts = [p.strip() for p in s.split(",") if p.strip() != ""]
-        if len(parts) != 8:
-            raise ValueError(f"Input must contain exactly 8 numerical values (got {len(parts)})")
-        nums = list(map(float, parts))
-        columns = ["MedInc","HouseAge","AveRooms","AveBedrms","Population","AveOccup","Latitude","Longitude"]
-        df = pd.DataFrame([nums], columns=columns)
-
-        raw_pred = model.predict(df)[0]
-        pred_eur_value = inverse_transform(raw_pred)
-        pred_usd_value = pred_eur_value * EUR_TO_USD
-
-        pred_eur_rounded = round(float(pred_eur_value), 2)
-        pred_usd_rounded = round(float(pred_usd_value), 2)
-
-        eur_fmt = format_eur_eu(pred_eur_rounded) + " EUR"
-        usd_fmt = format_usd_en(pred_usd_rounded) + " USD"
-
-        message_text = (
-            f"Estimated price: {eur_fmt} / {usd_fmt}\n\n"
-            f"Details:\n"
-            f"- Status: success\n"
-        )
+        x = parse_csv_input(data.input)
 
-        message_html = (
-            f"🏠 <b>Estimated price</b>\n"
-            f"{_html.escape(eur_fmt)} / {_html.escape(usd_fmt)}\n\n"
-            f"🔎 <b>Details</b>:\n"
-            f"• Status: {_html.escape('success')}"
-        )
-
-        return PredictResponse(
-            prediction=pred_eur_rounded,
-            prediction_eur=pred_eur_rounded,
-            prediction_usd=pred_usd_rounded,
-            prediction_eur_formatted=eur_fmt,
-            prediction_usd_formatted=usd_fmt,
-            status="success",
-            message_text=message_text,
-            message_html=message_html
-        )
+        raw_pred = await predict_raw(tuple(x.tolist()))
+        return prediction_response(raw_pred)
 
     except ValueError as ve:
         logger.warning(f"Validation error: {ve}")
@@ -209,3 +774,23 @@ def predict_from_string(data: PredictStringInput):
     except Exception as e:
         logger.error(f"Prediction error: {e}")
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+# lista acotada: más de PREDICT_BATCH_LIMIT filas -> 422 antes de predecir
+PredictBatch = Annotated[list[PredictRequest], Field(max_length=PREDICT_BATCH_LIMIT)]
+
+@app.post("/predict-batch", response_model=list[PredictResponse])
+async def predict_many(reqs: PredictBatch):
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if not reqs:
+        return Response(content="[]", media_type="application/json")
+    try:
+        # todas las filas en un único predict vectorizado, sin pasar por el
+        # micro-batcher
+        X = np.array([request_features(r) for r in reqs], dtype=INPUT_DTYPE)
+        raw_preds = await asyncio.wrap_future(_PREDICT_POOL.submit(predict_batch, X))
+        body = "[" + ",".join(map(prediction_body, raw_preds.tolist())) + "]"
+        return Response(content=body, media_type="application/json")
+    except Exception as e:
+        logger.error(f"Prediction error: {e}")
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
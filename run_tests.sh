@@ -85,6 +85,18 @@ case "${1:-all}" in
         print_status "Running fast tests only..."
         pytest -x -v --tb=short
         ;;
+    "benchmark")
+        print_status "Running benchmarks..."
+        pytest tests/test_integration.py -v -m "" -k benchmark --benchmark-max-time=2 --benchmark-disable-gc
+        ;;
+    "parallel")
+        print_status "Running tests in parallel (pytest-xdist, one file per worker)..."
+        pytest -n auto --dist=loadfile
+        ;;
+    "full")
+        print_status "Running every test, including slow and integration..."
+        pytest -v -m ""
+        ;;
     "docker")
         print_status "Running tests with Docker..."
         
@@ -140,11 +152,11 @@ case "${1:-all}" in
         
         # Model tests
         print_status "Step 2/4: Model tests..."
-        pytest tests/test_model.py -v
+        pytest tests/test_model.py -v -m ""
         
         # API tests
         print_status "Step 3/4: API tests..."
-        pytest tests/test_api.py -v
+        pytest tests/test_api.py -v -m ""
         
         # Integration tests
         print_status "Step 4/4: Integration tests..."
@@ -169,6 +181,9 @@ if [[ "${1}" == "help" ]] || [[ "${1}" == "--help" ]] || [[ "${1}" == "-h" ]]; t
     echo "  model       - Run ML model tests only"
     echo "  coverage    - Run tests with coverage report"
     echo "  fast        - Run tests with fail-fast mode"
+    echo "  full        - Run every test, including slow ones"
+    echo "  parallel    - Run tests across CPU cores with pytest-xdist"
+    echo "  benchmark   - Run pytest-benchmark API benchmarks"
     echo "  docker      - Run tests using Docker"
     echo "  lint        - Run code quality checks only"
     echo "  help        - Show this help message"
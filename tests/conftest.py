@@ -4,9 +4,13 @@ import os
 import sys
 import tempfile
 import shutil
+import httpx
+import pytest_asyncio
 from fastapi.testclient import TestClient
 import joblib
+import numpy as np
 import pandas as pd
+import sklearn
 from sklearn.datasets import fetch_california_housing
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
@@ -15,44 +19,92 @@ from sklearn.ensemble import RandomForestRegressor
 # Add app directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
 
-@pytest.fixture(scope="session")
-def test_model():
-    """Create a test model for testing purposes"""
-    # Create a simple test model with California housing data
+# Parámetros del modelo de test
+TEST_MODEL_ROWS = 100
+TEST_MODEL_ESTIMATORS = 10
+TEST_MODEL_SEED = 42
+
+# Caché en disco de los modelos ajustados, reutilizada entre ejecuciones de pytest
+# mmap_mode='r': cada worker de xdist mapea los arrays del bosque en vez de copiarlos
+memory = joblib.Memory(
+    os.path.join(os.path.dirname(__file__), '..', '.pytest_cache', 'joblib'),
+    mmap_mode='r',
+    verbose=0,
+)
+
+@memory.cache
+def _fit_test_model(sklearn_version, n_rows, n_estimators, seed):
+    # sklearn_version solo forma parte de la clave: otra versión invalida la caché
     data = fetch_california_housing(as_frame=True)
-    X = data.data.head(100)  # Use small subset for faster testing
-    y = data.target.head(100)
+    # Como scripts/train.py: arrays posicionales float32, sin feature_names_in_
+    # Use small subset for faster testing
+    X = data.data.head(n_rows).to_numpy(dtype=np.float32)
+    y = data.target.head(n_rows).to_numpy(dtype=np.float32)
     
     pipeline = Pipeline([
         ("scaler", StandardScaler()),
-        ("rf", RandomForestRegressor(n_estimators=10, random_state=42, n_jobs=1)),
+        ("rf", RandomForestRegressor(
+            n_estimators=n_estimators, random_state=seed, n_jobs=1
+        )),
     ])
     
-    pipeline.fit(X, y)
-    return pipeline
+    return pipeline.fit(X, y)
+
+def _fit_cached_test_model():
+    return _fit_test_model(
+        sklearn.__version__, TEST_MODEL_ROWS, TEST_MODEL_ESTIMATORS, TEST_MODEL_SEED
+    )
+
+def pytest_configure(config):
+    # Con xdist, el proceso controlador ajusta (o comprueba) el modelo de test una sola
+    # vez antes de lanzar los workers; ellos solo lo cargan de la caché. Los workers no
+    # entran aquí.
+    if hasattr(config, "workerinput"):
+        return
+    if not getattr(config.option, "numprocesses", None):
+        return
+    if config.option.collectonly or config.option.help:
+        return
+    _fit_cached_test_model()
+
+@pytest.fixture(scope="session")
+def test_model():
+    """Create a test model for testing purposes (cached on disk across sessions)"""
+    return _fit_cached_test_model()
 
 @pytest.fixture(scope="session")
 def test_model_file(test_model):
     """Create a temporary model file"""
     with tempfile.NamedTemporaryFile(suffix='.joblib', delete=False) as f:
-        joblib.dump(test_model, f.name)
+        joblib.dump(test_model, f.name, compress=0)
         yield f.name
     # Cleanup
     os.unlink(f.name)
 
-@pytest.fixture
-def client(test_model_file, monkeypatch):
-    """Create FastAPI test client with test model"""
-    # Set environment variables for testing
-    monkeypatch.setenv("MODEL_PATH", test_model_file)
-    monkeypatch.setenv("MODEL_WAIT_TIMEOUT", "5")
-    monkeypatch.setenv("PRICE_MULTIPLIER", "100000.0")
-    monkeypatch.setenv("EUR_TO_USD", "1.10")
-    
-    # Import app after setting environment variables
-    from main import app
-    
-    return TestClient(app)
+@pytest.fixture(scope="session")
+def client(test_model_file):
+    """Create FastAPI test client with test model (shared by the whole session)"""
+    # monkeypatch es function-scoped: para una fixture de sesión usamos su contexto
+    with pytest.MonkeyPatch.context() as mp:
+        # Set environment variables for testing
+        mp.setenv("MODEL_PATH", test_model_file)
+        mp.setenv("MODEL_WAIT_TIMEOUT", "5")
+        mp.setenv("PRICE_MULTIPLIER", "100000.0")
+        mp.setenv("EUR_TO_USD", "1.10")
+        
+        # Import app after setting environment variables
+        from main import app
+        
+        # como context manager: un único portal/event loop para todas las peticiones
+        with TestClient(app) as c:
+            yield c
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def aclient(client):
+    """Async client over ASGI for concurrent requests (one pooled client per session)"""
+    transport = httpx.ASGITransport(app=client.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
 
 @pytest.fixture
 def sample_housing_data():
@@ -73,7 +125,18 @@ def sample_csv_input():
     """Sample CSV string input for testing"""
     return "4.2,15,5.3,1.2,1800,3.1,34.05,-118.25"
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def california_housing_data():
     """Real California housing dataset for model testing"""
     return fetch_california_housing(as_frame=True)
+
+@pytest.fixture(scope="session")
+def housing_xy_1000(california_housing_data):
+    """First 1000 rows as read-only float32 arrays (X, y), shared by the session"""
+    data = california_housing_data
+    X = data.data.head(1000).to_numpy(dtype=np.float32, copy=True)
+    y = data.target.head(1000).to_numpy(dtype=np.float32, copy=True)
+    # ningún test debe mutarlos: se comparten entre todos
+    X.flags.writeable = False
+    y.flags.writeable = False
+    return X, y
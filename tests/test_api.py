@@ -3,6 +3,7 @@ Tests for the FastAPI application
 """
 import pytest
 import json
+import numpy as np
 from fastapi import status
 
 
@@ -25,7 +26,61 @@ class TestAPIEndpoints:
         data = response.json()
         assert data["status"] == "healthy"
         assert data["model_loaded"] is True
-        assert "model_path" in data
+        assert data["model_path"].endswith("model.joblib")
+
+    def test_health_reports_trees_artifact(self, california_housing_data, tmp_path):
+        """Test /health reports trees.npz when MODEL_BACKEND=trees loads it"""
+        import importlib.util
+        import os
+        import pathlib
+        import subprocess
+        import sys
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        from sklearn.pipeline import Pipeline
+
+        root = pathlib.Path(__file__).resolve().parent.parent
+        spec = importlib.util.spec_from_file_location(
+            "train", root / "scripts" / "train.py"
+        )
+        train = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(train)
+
+        X = california_housing_data.data.head(200).to_numpy()
+        y = california_housing_data.target.head(200).to_numpy()
+        gbdt = HistGradientBoostingRegressor(max_iter=5, random_state=42)
+        trees_path = tmp_path / "trees.npz"
+        train.export_tree_arrays(Pipeline([("gbdt", gbdt)]).fit(X, y), trees_path)
+
+        # fresh interpreter: the session app is already bound to the sklearn backend
+        script = (
+            "from fastapi.testclient import TestClient\n"
+            "from main import app\n"
+            "print(TestClient(app).get('/health').json()['model_path'])\n"
+        )
+        env = dict(
+            os.environ,
+            MODEL_BACKEND="trees",
+            TREES_PATH=str(trees_path),
+            MODEL_WAIT_TIMEOUT="5",
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=root / "app", env=env, capture_output=True, text=True, timeout=60,
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1] == str(trees_path)
+
+    def test_cache_stats_endpoint(self, client, sample_housing_data):
+        """Test that repeated predictions are served from the cache"""
+        client.post("/predict", json=sample_housing_data)
+        before = client.get("/cache-stats").json()
+        client.post("/predict", json=sample_housing_data)
+        after = client.get("/cache-stats").json()
+
+        for key in ["hits", "misses", "maxsize", "currsize"]:
+            assert key in after
+        assert after["hits"] == before["hits"] + 1
+        assert after["misses"] == before["misses"]
 
 
 class TestPredictEndpoint:
@@ -105,6 +160,42 @@ class TestPredictEndpoint:
         assert data["status"] == "success"
 
 
+class TestPredictBatchEndpoint:
+    """Test the batched prediction endpoint"""
+    
+    def test_predict_batch_matches_single(self, client, sample_housing_data):
+        """Test each batched result matches the single-row endpoint"""
+        other = {**sample_housing_data, "MedInc": 8.5}
+        response = client.post("/predict-batch", json=[sample_housing_data, other])
+        assert response.status_code == status.HTTP_200_OK
+        
+        data = response.json()
+        assert len(data) == 2
+        for row, result in zip([sample_housing_data, other], data):
+            single = client.post("/predict", json=row).json()
+            assert result == single
+    
+    def test_predict_batch_empty(self, client):
+        """Test an empty batch returns an empty list"""
+        response = client.post("/predict-batch", json=[])
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == []
+    
+    def test_predict_batch_over_limit(self, client, sample_housing_data):
+        """Test a batch above PREDICT_BATCH_LIMIT is rejected before predicting"""
+        from main import PREDICT_BATCH_LIMIT
+        
+        rows = [sample_housing_data] * (PREDICT_BATCH_LIMIT + 1)
+        response = client.post("/predict-batch", json=rows)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    
+    def test_predict_batch_invalid_row(self, client, sample_housing_data):
+        """Test one invalid row rejects the whole batch"""
+        rows = [sample_housing_data, {"MedInc": 4.2}]
+        response = client.post("/predict-batch", json=rows)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 class TestPredictFromStringEndpoint:
     """Test the CSV string prediction endpoint"""
     
@@ -145,6 +236,7 @@ class TestPredictFromStringEndpoint:
         payload = {"input": "4.2,abc,5.3,1.2,1800,3.1,34.05,-118.25"}
         response = client.post("/predict-from-string", json=payload)
         assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "numerical" in response.json()["detail"]
     
     def test_predict_from_string_empty_input(self, client):
         """Test empty CSV string"""
@@ -152,6 +244,29 @@ class TestPredictFromStringEndpoint:
         response = client.post("/predict-from-string", json=payload)
         assert response.status_code == status.HTTP_400_BAD_REQUEST
     
+    @pytest.mark.parametrize("csv_input", [
+        "4.2,,15,5.3,1.2,1800,3.1,34.05,-118.25",
+        "4.2,15,5.3,1.2,1800,3.1,34.05,-118.25,",
+        "4.2,15,5.3,1.2,1800,3.1,34.05,-118.25,,",
+        "4.2;15;5.3;1.2;1800;3.1;34.05;-118.25;",
+    ], ids=[
+        "empty-field",
+        "trailing-separator",
+        "two-trailing-separators",
+        "trailing-semicolon",
+    ])
+    def test_predict_from_string_ignores_empty_fields(
+        self, client, sample_csv_input, csv_input
+    ):
+        """Test empty fields and trailing separators are ignored"""
+        response = client.post("/predict-from-string", json={"input": csv_input})
+        assert response.status_code == status.HTTP_200_OK
+        
+        expected = client.post(
+            "/predict-from-string", json={"input": sample_csv_input}
+        ).json()
+        assert response.json()["prediction"] == expected["prediction"]
+    
     def test_predict_from_string_whitespace_handling(self, client):
         """Test CSV string with extra whitespace"""
         payload = {"input": " 4.2 , 15 , 5.3 , 1.2 , 1800 , 3.1 , 34.05 , -118.25 "}
@@ -177,6 +292,40 @@ class TestResponseFormatting:
         usd_formatted = data["prediction_usd_formatted"]
         assert "USD" in usd_formatted
     
+    def test_currency_formatters(self):
+        """Test EUR/USD formatters on known values"""
+        from main import format_eur_eu, format_usd_en
+
+        assert format_eur_eu(1234567.891) == "1.234.567,89"
+        assert format_eur_eu(0.5) == "0,50"
+        assert format_usd_en(1234567.891) == "1,234,567.89"
+
+    def test_messages_escape_unexpected_text(self):
+        """Test amounts outside the expected format are HTML-escaped, not rejected"""
+        from main import _build_messages
+
+        message_text, message_html = _build_messages("<1> EUR", "2 USD")
+        assert "&lt;1&gt; EUR" in message_html
+        assert "<1> EUR" in message_text
+
+    @pytest.mark.parametrize(
+        "raw, house_age",
+        [(float("nan"), 15.123), (float("inf"), 16.123)],
+        ids=["nan", "inf"],
+    )
+    def test_non_finite_prediction_is_a_clear_error(
+        self, client, sample_housing_data, monkeypatch, raw, house_age
+    ):
+        """Test a nan/inf model output returns a clear 500 instead of formatting it"""
+        import main
+
+        monkeypatch.setattr(main.batcher, "_predict_fn", lambda X: np.full(len(X), raw))
+        # unseen input so the prediction cache can't answer it
+        payload = {**sample_housing_data, "HouseAge": house_age}
+        response = client.post("/predict", json=payload)
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+        assert "non-finite prediction" in response.json()["detail"]
+
     def test_html_message_structure(self, client, sample_housing_data):
         """Test HTML message structure for Telegram"""
         response = client.post("/predict", json=sample_housing_data)
@@ -237,6 +386,73 @@ class TestErrorHandling:
         assert response.status_code in [400, 422, 500]
 
 
+class TestModelLoading:
+    """Test waiting for the model file at startup"""
+
+    def test_wait_for_model_detects_new_file(self, tmp_path):
+        """Test that a model file created while waiting is picked up promptly"""
+        import threading
+        import time
+        from main import wait_for_model
+
+        model_path = tmp_path / "model.joblib"
+        threading.Timer(0.2, model_path.write_bytes, args=(b"model",)).start()
+
+        start_time = time.time()
+        assert wait_for_model(str(model_path), timeout=10) is True
+        assert time.time() - start_time < 2.0
+
+    def test_load_model_waits_for_file_close(self, tmp_path):
+        """Test a model written in two chunks loads only once the writer closes it"""
+        import io
+        import threading
+        import time
+        import joblib
+        from main import load_model_safely
+
+        buf = io.BytesIO()
+        joblib.dump({"weights": list(range(1000))}, buf)
+        data = buf.getvalue()
+        model_path = tmp_path / "model.joblib"
+        closed_at = []
+
+        def write_in_two_chunks():
+            with open(model_path, "wb") as f:
+                f.write(data[:len(data) // 2])
+                f.flush()
+                time.sleep(0.5)
+                f.write(data[len(data) // 2:])
+            closed_at.append(time.monotonic())
+
+        writer = threading.Timer(0.2, write_in_two_chunks)
+        writer.start()
+        model = load_model_safely(str(model_path), timeout=10)
+        loaded_at = time.monotonic()
+        writer.join()
+
+        assert model == {"weights": list(range(1000))}
+        assert loaded_at >= closed_at[0] - 0.05
+
+    def test_wait_for_model_detects_atomic_rename(self, tmp_path):
+        """Test that a model moved into place (atomic rename) is picked up"""
+        import os
+        import threading
+        from main import wait_for_model
+
+        model_path = tmp_path / "model.joblib"
+        partial = tmp_path / "model.joblib.tmp"
+        partial.write_bytes(b"model")
+        threading.Timer(0.2, os.replace, args=(partial, model_path)).start()
+
+        assert wait_for_model(str(model_path), timeout=10) is True
+
+    def test_wait_for_model_timeout(self, tmp_path):
+        """Test that waiting gives up after the timeout"""
+        from main import wait_for_model
+
+        assert wait_for_model(str(tmp_path / "missing.joblib"), timeout=1) is False
+
+
 class TestPerformance:
     """Test performance aspects"""
     
@@ -268,3 +484,216 @@ class TestPerformance:
             assert response.status_code == status.HTTP_200_OK
             data = response.json()
             assert data["status"] == "success"
+
+    def test_fused_scaler_matches_pipeline(self, test_model, california_housing_data):
+        """Test that the fused scaler+estimator path matches Pipeline.predict"""
+        import numpy as np
+        from main import PREDICT_MAX_BATCH, build_sklearn_predictor, sklearn_input_dtype
+
+        # full dataset: single-row rounding differences must not hide in a small sample
+        X_full = california_housing_data.data.to_numpy()
+        expected = test_model.predict(X_full)
+        # rows reach the predictor as the micro-batcher builds them
+        X = X_full.astype(sklearn_input_dtype(test_model))
+        predict = build_sklearn_predictor(test_model)
+
+        # batches that fit the per-thread buffers, and one large batch using
+        # temporary arrays
+        starts = range(0, len(X), PREDICT_MAX_BATCH)
+        batched = np.concatenate([predict(X[i:i + PREDICT_MAX_BATCH]) for i in starts])
+        np.testing.assert_array_equal(batched, expected)
+        np.testing.assert_array_equal(predict(X), expected)
+
+    def test_unrolled_pipeline_matches_pipeline(self, california_housing_data):
+        """Test that pipelines with other transforms are unrolled step by step"""
+        import numpy as np
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.impute import SimpleImputer
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+        from main import build_sklearn_predictor
+
+        X = california_housing_data.data.head(200).to_numpy()
+        y = california_housing_data.target.head(200).to_numpy()
+        pipeline = Pipeline([
+            ("imputer", SimpleImputer()),
+            ("scaler", StandardScaler()),
+            ("rf", RandomForestRegressor(n_estimators=5, random_state=42, n_jobs=1)),
+        ]).fit(X, y)
+        predict = build_sklearn_predictor(pipeline)
+
+        np.testing.assert_allclose(predict(X[:20]), pipeline.predict(X[:20]))
+
+    def test_hgb_pipeline_backends_match_pipeline(
+        self, california_housing_data, tmp_path
+    ):
+        """Test the shipped single-step HGB pipeline on the sklearn and trees paths"""
+        import importlib.util
+        import pathlib
+        import numpy as np
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        from sklearn.pipeline import Pipeline
+        from main import TreeEnsemble, build_sklearn_predictor, sklearn_input_dtype
+
+        root = pathlib.Path(__file__).resolve().parent.parent
+        train_path = root / "scripts" / "train.py"
+        spec = importlib.util.spec_from_file_location("train", train_path)
+        train = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(train)
+
+        X = california_housing_data.data.head(500).to_numpy(dtype=np.float64, copy=True)
+        y = california_housing_data.target.head(500).to_numpy()
+        # missing values in training and prediction exercise missing_go_to_left
+        rng = np.random.default_rng(0)
+        X[rng.random(X.shape) < 0.1] = np.nan
+        gbdt = HistGradientBoostingRegressor(max_iter=20, max_depth=4, random_state=42)
+        pipeline = Pipeline([("gbdt", gbdt)]).fit(X, y)
+        expected = pipeline.predict(X)
+
+        assert sklearn_input_dtype(pipeline) == np.float64
+        np.testing.assert_array_equal(build_sklearn_predictor(pipeline)(X), expected)
+
+        trees_path = tmp_path / "trees.npz"
+        train.export_tree_arrays(pipeline, trees_path)
+        ensemble = TreeEnsemble.load(str(trees_path))
+        np.testing.assert_allclose(ensemble.predict(X), expected, rtol=1e-12)
+
+    def test_dataframe_fitted_pipelines_do_not_warn(self, california_housing_data):
+        """Test DataFrame-fitted pipelines are served from arrays without warnings"""
+        import warnings
+        import numpy as np
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.impute import SimpleImputer
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+        from main import build_sklearn_predictor
+
+        X_df = california_housing_data.data.head(200)
+        y = california_housing_data.target.head(200)
+        X = X_df.to_numpy()
+        pipelines = [
+            Pipeline([("rf", RandomForestRegressor(n_estimators=5, random_state=42))]),
+            Pipeline([
+                ("imputer", SimpleImputer()),
+                ("scaler", StandardScaler()),
+                ("rf", RandomForestRegressor(n_estimators=5, random_state=42)),
+            ]),
+        ]
+        for pipeline in pipelines:
+            pipeline.fit(X_df, y)
+            predict = build_sklearn_predictor(pipeline)
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                preds = predict(X[:20])
+            np.testing.assert_array_equal(preds, pipeline.predict(X_df.head(20)))
+            # the loaded model itself keeps its feature names
+            assert pipeline.steps[0][1].feature_names_in_ is not None
+
+    def test_feature_order_mismatch_is_rejected(self, california_housing_data):
+        """Test a model fitted with a different column order is refused at build time"""
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+        from main import build_sklearn_predictor, scaler_params
+
+        data = california_housing_data.data.head(50)
+        reversed_data = data[data.columns[::-1]]
+        target = california_housing_data.target.head(50)
+        rf = RandomForestRegressor(n_estimators=2, random_state=42)
+        rf.fit(reversed_data, target)
+        with pytest.raises(RuntimeError, match="expected"):
+            build_sklearn_predictor(rf)
+
+        # legacy scaler+rf layout: the scaler is the step fed positionally
+        pipeline = Pipeline([
+            ("scaler", StandardScaler()),
+            ("rf", RandomForestRegressor(n_estimators=2, random_state=42)),
+        ]).fit(reversed_data, target)
+        with pytest.raises(RuntimeError, match="expected"):
+            build_sklearn_predictor(pipeline)
+        with pytest.raises(RuntimeError, match="expected"):
+            scaler_params(pipeline)
+
+    def test_tree_ensemble_traversal(self):
+        """Test flat-array tree traversal on two hand-built stumps"""
+        import numpy as np
+        from main import TreeEnsemble
+
+        # each tree: root splits on feature 0 / 1 at 0.5, leaves 1 and 2
+        ensemble = TreeEnsemble({
+            "children_left": np.array([[1, -1, -1], [1, -1, -1]]),
+            "children_right": np.array([[2, -1, -1], [2, -1, -1]]),
+            "feature": np.array([[0, 0, 0], [1, 0, 0]]),
+            "threshold": np.array([[0.5, 0.0, 0.0], [0.5, 0.0, 0.0]]),
+            "value": np.array([[0.0, 1.0, 2.0], [0.0, 10.0, 20.0]]),
+            "missing_go_to_left": np.array(
+                [[True, False, False], [False, False, False]]
+            ),
+            "scale": np.float64(1.0),
+            "bias": np.float64(0.5),
+        })
+        X = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0], [np.nan, np.nan]])
+
+        np.testing.assert_allclose(ensemble.predict(X), [11.5, 12.5, 21.5, 21.5])
+
+    def test_micro_batcher_coalesces_rows(self):
+        """Test that concurrent submissions are resolved in shared batches"""
+        import concurrent.futures
+        from main import MicroBatcher
+
+        batch_sizes = []
+
+        def fake_predict(X):
+            batch_sizes.append(len(X))
+            return X[:, 0] * 2
+
+        batcher = MicroBatcher(fake_predict, max_batch=64, max_wait_ms=50)
+        rows = [tuple([float(i)] * 8) for i in range(16)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(lambda r: batcher.submit(r).result(), rows))
+
+        assert results == [r[0] * 2 for r in rows]
+        assert sum(batch_sizes) == len(rows)
+        assert len(batch_sizes) < len(rows)
+
+    @pytest.mark.parametrize("predict_fn", [
+        pytest.param(lambda X: 1 / 0, id="raises"),
+        pytest.param(lambda X: X[:-1, 0], id="short-result"),
+    ])
+    def test_micro_batcher_fails_instead_of_hanging(self, predict_fn):
+        """Test a failing or short predict_fn fails every waiting row"""
+        import concurrent.futures
+        from main import MicroBatcher
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            batcher = MicroBatcher(
+                predict_fn, max_batch=8, max_wait_ms=20, executor=pool
+            )
+            futures = [batcher.submit(tuple([float(i)] * 8)) for i in range(4)]
+            for fut in futures:
+                # a future left pending would raise TimeoutError here instead
+                with pytest.raises((ZeroDivisionError, RuntimeError)):
+                    fut.result(timeout=5)
+
+    def test_micro_batcher_malformed_row_does_not_hang(self):
+        """Test a row that can't fill the batch buffer fails instead of hanging"""
+        from main import MicroBatcher
+
+        batcher = MicroBatcher(lambda X: X[:, 0], max_batch=8, max_wait_ms=20)
+        good = batcher.submit(tuple([1.0] * 8))
+        bad = batcher.submit((1.0, 2.0))
+        for fut in (good, bad):
+            with pytest.raises(ValueError):
+                fut.result(timeout=5)
+
+    def test_predict_fails_when_model_returns_short_result(
+        self, client, sample_housing_data, monkeypatch
+    ):
+        """Test /predict answers 500 instead of hanging on a short model result"""
+        import main
+
+        monkeypatch.setattr(main.batcher, "_predict_fn", lambda X: X[:0, 0])
+        # unseen input so the prediction cache can't answer it
+        payload = {**sample_housing_data, "MedInc": 4.123456}
+        response = client.post("/predict", json=payload)
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
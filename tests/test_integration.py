@@ -2,27 +2,135 @@
 Integration tests for the complete ML pipeline
 """
 import pytest
+import numpy as np
 import requests
+import asyncio
 import subprocess
 import time
 import os
 import json
+import logging
+import pathlib
+import types
+
+
+logger = logging.getLogger(__name__)
+
+# For requests whose JSON body is serialized up front and sent with content=
+JSON_HEADERS = {"content-type": "application/json"}
+
+# Project paths, resolved once
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+TRAIN = ROOT / "scripts" / "train.py"
+API = ROOT / "app" / "main.py"
+
+# Test cases representing different types of California housing
+REAL_DATA_CASES = [
+    {
+        "name": "Low-income urban",
+        "data": {
+            "MedInc": 2.5,
+            "HouseAge": 30.0,
+            "AveRooms": 4.0,
+            "AveBedrms": 1.1,
+            "Population": 5000.0,
+            "AveOccup": 4.0,
+            "Latitude": 34.0,
+            "Longitude": -118.0
+        }
+    },
+    {
+        "name": "High-income suburban",
+        "data": {
+            "MedInc": 8.5,
+            "HouseAge": 10.0,
+            "AveRooms": 7.0,
+            "AveBedrms": 1.2,
+            "Population": 2000.0,
+            "AveOccup": 2.5,
+            "Latitude": 37.5,
+            "Longitude": -122.0
+        }
+    },
+    {
+        "name": "Rural area",
+        "data": {
+            "MedInc": 3.8,
+            "HouseAge": 25.0,
+            "AveRooms": 5.5,
+            "AveBedrms": 1.3,
+            "Population": 800.0,
+            "AveOccup": 2.8,
+            "Latitude": 36.0,
+            "Longitude": -119.5
+        }
+    }
+]
+
+EDGE_CASES = [
+    {
+        "name": "Very large numbers",
+        "data": {
+            "MedInc": 1e6,
+            "HouseAge": 15.0,
+            "AveRooms": 5.3,
+            "AveBedrms": 1.2,
+            "Population": 1800.0,
+            "AveOccup": 3.1,
+            "Latitude": 34.05,
+            "Longitude": -118.25
+        }
+    },
+    {
+        "name": "Negative values",
+        "data": {
+            "MedInc": -1.0,
+            "HouseAge": 15.0,
+            "AveRooms": 5.3,
+            "AveBedrms": 1.2,
+            "Population": 1800.0,
+            "AveOccup": 3.1,
+            "Latitude": 34.05,
+            "Longitude": -118.25
+        }
+    },
+    {
+        "name": "Zero values",
+        "data": {
+            "MedInc": 0.0,
+            "HouseAge": 0.0,
+            "AveRooms": 0.0,
+            "AveBedrms": 0.0,
+            "Population": 0.0,
+            "AveOccup": 0.0,
+            "Latitude": 0.0,
+            "Longitude": 0.0
+        }
+    }
+]
+
+
+@pytest.fixture(scope="session")
+def project_paths():
+    """Project file paths plus whether each exists (one stat per path per session)"""
+    return types.SimpleNamespace(
+        root=ROOT, train=TRAIN, api=API,
+        train_exists=TRAIN.is_file(), api_exists=API.is_file(),
+    )
 
 
 class TestPipelineIntegration:
     """Test the complete ML pipeline integration"""
     
-    def test_model_training_to_api_pipeline(self, tmp_path):
+    def test_model_training_to_api_pipeline(self, tmp_path, project_paths):
         """Test complete pipeline from training to API serving"""
         # Note: This is a conceptual test - in practice you might use Docker containers
         
         # 1. Verify training script exists and is executable
-        training_script = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'train.py')
-        assert os.path.exists(training_script)
+        assert project_paths.train_exists, project_paths.train
         
         # 2. Verify API script exists
-        api_script = os.path.join(os.path.dirname(__file__), '..', 'app', 'main.py')
-        assert os.path.exists(api_script)
+        assert project_paths.api_exists, project_paths.api
         
         # 3. Test data flow consistency
         sample_input = {
@@ -70,66 +178,24 @@ class TestDockerIntegration:
 class TestAPIIntegration:
     """Test API integration scenarios"""
     
-    def test_api_with_real_data_samples(self, client):
+    @pytest.mark.parametrize("case", REAL_DATA_CASES, ids=lambda c: c["name"])
+    def test_api_with_real_data_samples(self, client, case):
         """Test API with various real-world data samples"""
-        # Test cases representing different types of California housing
-        test_cases = [
-            {
-                "name": "Low-income urban",
-                "data": {
-                    "MedInc": 2.5,
-                    "HouseAge": 30.0,
-                    "AveRooms": 4.0,
-                    "AveBedrms": 1.1,
-                    "Population": 5000.0,
-                    "AveOccup": 4.0,
-                    "Latitude": 34.0,
-                    "Longitude": -118.0
-                }
-            },
-            {
-                "name": "High-income suburban",
-                "data": {
-                    "MedInc": 8.5,
-                    "HouseAge": 10.0,
-                    "AveRooms": 7.0,
-                    "AveBedrms": 1.2,
-                    "Population": 2000.0,
-                    "AveOccup": 2.5,
-                    "Latitude": 37.5,
-                    "Longitude": -122.0
-                }
-            },
-            {
-                "name": "Rural area",
-                "data": {
-                    "MedInc": 3.8,
-                    "HouseAge": 25.0,
-                    "AveRooms": 5.5,
-                    "AveBedrms": 1.3,
-                    "Population": 800.0,
-                    "AveOccup": 2.8,
-                    "Latitude": 36.0,
-                    "Longitude": -119.5
-                }
-            }
-        ]
-        
-        for case in test_cases:
-            response = client.post("/predict", json=case["data"])
-            assert response.status_code == 200
-            
-            data = response.json()
-            assert data["status"] == "success"
-            assert data["prediction"] > 0
-            
-            # Predictions should be within reasonable ranges
-            # (California housing dataset is in units of 100k)
-            assert 0.5 <= data["prediction"] <= 8.0
-            
-            print(f"{case['name']}: ${data['prediction_usd_formatted']}")
+        response = client.post("/predict", json=case["data"])
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert data["status"] == "success"
+        assert data["prediction"] > 0
+        
+        # Predictions should be within reasonable ranges
+        # (California housing dataset is in units of 100k)
+        assert 0.5 <= data["prediction"] <= 8.0
+        
+        logger.info("%s: $%s", case["name"], data["prediction_usd_formatted"])
     
-    def test_api_response_format_consistency(self, client):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_api_response_format_consistency(self, aclient):
         """Test that API responses are consistent across different endpoints"""
         sample_data = {
             "MedInc": 4.2,
@@ -142,13 +208,14 @@ class TestAPIIntegration:
             "Longitude": -118.25
         }
         
-        # Test structured endpoint
-        response1 = client.post("/predict", json=sample_data)
-        data1 = response1.json()
-        
-        # Test string endpoint
         csv_input = "4.2,15.0,5.3,1.2,1800.0,3.1,34.05,-118.25"
-        response2 = client.post("/predict-from-string", json={"input": csv_input})
+        
+        # Test structured and string endpoints concurrently
+        response1, response2 = await asyncio.gather(
+            aclient.post("/predict", json=sample_data),
+            aclient.post("/predict-from-string", json={"input": csv_input}),
+        )
+        data1 = response1.json()
         data2 = response2.json()
         
         # Both responses should have same structure
@@ -176,61 +243,27 @@ class TestErrorScenarios:
         response = client.post("/predict", data="{}")
         assert response.status_code in [400, 422]
     
-    def test_api_input_validation_edge_cases(self, client):
+    @pytest.mark.parametrize("case", EDGE_CASES, ids=lambda c: c["name"])
+    def test_api_input_validation_edge_cases(self, client, case):
         """Test API input validation with edge cases"""
-        edge_cases = [
-            # Very large numbers
-            {
-                "MedInc": 1e6,
-                "HouseAge": 15.0,
-                "AveRooms": 5.3,
-                "AveBedrms": 1.2,
-                "Population": 1800.0,
-                "AveOccup": 3.1,
-                "Latitude": 34.05,
-                "Longitude": -118.25
-            },
-            # Negative values where they shouldn't be
-            {
-                "MedInc": -1.0,
-                "HouseAge": 15.0,
-                "AveRooms": 5.3,
-                "AveBedrms": 1.2,
-                "Population": 1800.0,
-                "AveOccup": 3.1,
-                "Latitude": 34.05,
-                "Longitude": -118.25
-            },
-            # Zero values
-            {
-                "MedInc": 0.0,
-                "HouseAge": 0.0,
-                "AveRooms": 0.0,
-                "AveBedrms": 0.0,
-                "Population": 0.0,
-                "AveOccup": 0.0,
-                "Latitude": 0.0,
-                "Longitude": 0.0
-            }
-        ]
-        
-        for case in edge_cases:
-            response = client.post("/predict", json=case)
-            # API should handle these gracefully (either succeed or fail cleanly)
-            assert response.status_code in [200, 400, 422, 500]
-            
-            if response.status_code == 200:
-                data = response.json()
-                assert "prediction" in data
+        response = client.post("/predict", json=case["data"])
+        # API should handle these gracefully (either succeed or fail cleanly)
+        assert response.status_code in [200, 400, 422, 500]
+        
+        if response.status_code == 200:
+            data = response.json()
+            assert "prediction" in data
 
 
 class TestPerformanceIntegration:
     """Test performance characteristics of the integrated system"""
     
-    def test_api_throughput(self, client):
-        """Test API can handle reasonable throughput"""
+    @pytest.mark.slow
+    @pytest.mark.asyncio(loop_scope="session")
+    @pytest.mark.parametrize("batch_size", [1, 20])
+    async def test_api_throughput(self, aclient, batch_size):
+        """Test API can handle reasonable throughput (single-row and batched)"""
         import time
-        import statistics
         
         sample_data = {
             "MedInc": 4.2,
@@ -243,37 +276,79 @@ class TestPerformanceIntegration:
             "Longitude": -118.25
         }
         
-        # Measure response times for multiple requests
-        response_times = []
+        # Measure per-record response times for 20 records, sent concurrently
         num_requests = 20
-        
-        for _ in range(num_requests):
-            start_time = time.time()
-            response = client.post("/predict", json=sample_data)
-            end_time = time.time()
-            
+        num_posts = num_requests // batch_size
+        response_times = [0] * num_posts  # ns, one slot per request
+        
+        # Serialize the request body once, outside the timed section
+        if batch_size == 1:
+            url, payload = "/predict", json.dumps(sample_data).encode()
+        else:
+            url = "/predict-batch"
+            payload = json.dumps([sample_data] * batch_size).encode()
+        
+        async def timed_post(i):
+            t0 = time.perf_counter_ns()
+            response = await aclient.post(url, content=payload, headers=JSON_HEADERS)
+            response_times[i] = (time.perf_counter_ns() - t0) // batch_size
             assert response.status_code == 200
-            response_times.append(end_time - start_time)
         
-        # Calculate statistics
-        avg_time = statistics.mean(response_times)
-        max_time = max(response_times)
-        min_time = min(response_times)
+        await asyncio.gather(*(timed_post(i) for i in range(num_posts)))
+        
+        # Calculate statistics (converted to seconds only here)
+        times = np.asarray(response_times) / 1e9
+        avg_time, max_time, min_time = times.mean(), times.max(), times.min()
+        p95_time = np.percentile(times, 95)
         
         # Performance assertions
         assert avg_time < 1.0  # Average response time under 1 second
         assert max_time < 3.0  # No request takes more than 3 seconds
+        assert p95_time < 0.5  # Tail latency: 95% of requests under 0.5 seconds
         
-        print(f"Performance stats - Avg: {avg_time:.3f}s, Min: {min_time:.3f}s, Max: {max_time:.3f}s")
+        logger.info(
+            "Performance stats (batch=%d) - "
+            "Avg: %.3fs, Min: %.3fs, Max: %.3fs, P95: %.3fs",
+            batch_size, avg_time, min_time, max_time, p95_time,
+        )
     
-    def test_memory_usage_stability(self, client):
+    @pytest.mark.slow
+    def test_api_benchmark(self, client, request):
+        """Benchmark /predict latency with pytest-benchmark (warmup + outlier stats)"""
+        # optional plugin: skip when pytest-benchmark is missing or disabled
+        # (-p no:benchmark)
+        if not request.config.pluginmanager.hasplugin("benchmark"):
+            pytest.skip("pytest-benchmark not available")
+        benchmark = request.getfixturevalue("benchmark")
+        
+        sample_data = {
+            "MedInc": 4.2,
+            "HouseAge": 15.0,
+            "AveRooms": 5.3,
+            "AveBedrms": 1.2,
+            "Population": 1800.0,
+            "AveOccup": 3.1,
+            "Latitude": 34.05,
+            "Longitude": -118.25
+        }
+        
+        payload = json.dumps(sample_data).encode()
+        
+        response = benchmark.pedantic(
+            lambda: client.post("/predict", content=payload, headers=JSON_HEADERS),
+            rounds=50, warmup_rounds=5,
+        )
+        assert response.status_code == 200
+    
+    @pytest.mark.slow
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_memory_usage_stability(self, aclient):
         """Test that memory usage remains stable during operation"""
-        import psutil
-        import os
+        import tracemalloc
         
-        # Get current process
-        process = psutil.Process(os.getpid())
-        initial_memory = process.memory_info().rss
+        # Trace Python allocations made while serving the requests
+        tracemalloc.start()
+        initial_snapshot = tracemalloc.take_snapshot()
         
         sample_data = {
             "MedInc": 4.2,
@@ -286,26 +361,35 @@ class TestPerformanceIntegration:
             "Longitude": -118.25
         }
         
-        # Make many requests
-        for _ in range(100):
-            response = client.post("/predict", json=sample_data)
-            assert response.status_code == 200
+        payload = json.dumps(sample_data).encode()
+        
+        # Make many requests concurrently
+        responses = await asyncio.gather(
+            *(
+                aclient.post("/predict", content=payload, headers=JSON_HEADERS)
+                for _ in range(100)
+            )
+        )
+        assert all(response.status_code == 200 for response in responses)
         
-        final_memory = process.memory_info().rss
-        memory_increase = final_memory - initial_memory
+        final_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        stats = final_snapshot.compare_to(initial_snapshot, "lineno")
+        memory_increase = sum(stat.size_diff for stat in stats)
         
         # Memory increase should be reasonable (less than 50MB)
         assert memory_increase < 50 * 1024 * 1024
         
-        print(f"Memory usage - Initial: {initial_memory/1024/1024:.1f}MB, "
-              f"Final: {final_memory/1024/1024:.1f}MB, "
-              f"Increase: {memory_increase/1024/1024:.1f}MB")
+        logger.info("Memory usage - Increase: %.1fMB", memory_increase / 1024 / 1024)
+        for stat in stats[:3]:
+            logger.info("  %s", stat)
 
 
 class TestDataPipeline:
     """Test data pipeline integrity"""
     
-    def test_feature_order_consistency(self, client):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_feature_order_consistency(self, aclient):
         """Test that feature order is consistent throughout the pipeline"""
         # The order should be: MedInc,HouseAge,AveRooms,AveBedrms,Population,AveOccup,Latitude,Longitude
         
@@ -322,8 +406,10 @@ class TestDataPipeline:
         
         csv_data = "1.0,2.0,3.0,4.0,5.0,6.0,7.0,8.0"
         
-        response1 = client.post("/predict", json=structured_data)
-        response2 = client.post("/predict-from-string", json={"input": csv_data})
+        response1, response2 = await asyncio.gather(
+            aclient.post("/predict", json=structured_data),
+            aclient.post("/predict-from-string", json={"input": csv_data}),
+        )
         
         assert response1.status_code == 200
         assert response2.status_code == 200